@@ -1,9 +1,18 @@
+import io
+import multiprocessing
 import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from flask import Flask, render_template, request, send_file
+from werkzeug.utils import secure_filename
 from datetime import datetime
+from functools import lru_cache
+from itertools import chain, islice
+from operator import itemgetter
 import fitz
-import pandas as pd
-import csv
 import re
 
 app = Flask(__name__)
@@ -13,499 +22,541 @@ RESULT_FOLDER = "results"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULT_FOLDER, exist_ok=True)
 
+# Set SAVE_RESULTS=1 to keep a copy of every generated CSV in RESULT_FOLDER;
+# otherwise /upload streams the CSV straight from memory
+SAVE_RESULTS = os.environ.get("SAVE_RESULTS") == "1"
+
+# Uploads are converted in a pool of this many processes, so concurrent requests use
+# every core instead of queuing on the GIL. Created on first use, not at import, and
+# replaced if a worker dies (e.g. MuPDF crashing on a malformed PDF, or an OOM kill).
+CONVERT_WORKERS = os.cpu_count() or 1
+_convert_pool = None
+_convert_pool_lock = threading.Lock()
+
+# get_text("text") flags without ligature/whitespace preservation: the parsers only need
+# linear text. Mediabox clipping is kept - flags=0 lets off-page text into the output.
+TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_LIGATURES & ~fitz.TEXT_PRESERVE_WHITESPACE
+
+# --------------------------------------------------------------------
+#  PATTERNS
+# --------------------------------------------------------------------
+# Compiled once at import so the parsers don't pay the re-cache lookup per line.
+# Parsers and helpers use these objects only - no module-level re.search/findall/sub
+# calls - so the patterns can't be evicted from re's internal cache by other regex use.
+
+# ByOrderOf / Beneficiary patterns, tried in this order; the first one whose value isn't
+# empty wins (order matters when a line carries several markers). IGNORECASE is kept
+# as before: on the lowercased text it still lets "beneficiary" match e.g. a dotless i.
+_BY_ORDER_PATTERNS = (
+    re.compile(r'ft\s*-\s*by\s+order\s+of\s*[:-]?\s*(.+)', re.IGNORECASE),  # "Ft - By Order Of VALUE"
+    re.compile(r'by\s+order\s+of\s*[:-]?\s*(.+)', re.IGNORECASE),  # "By Order Of: VALUE"
+)
+# "Order Of: VALUE", only tried when the line has no "by order of"
+_ORDER_OF_PATTERNS = (re.compile(r'order\s+of\s*[:-]?\s*(.+)', re.IGNORECASE),)
+_BEN_PATTERNS = (
+    re.compile(r'ft\s*-\s*ben\s*-\s*(.+)', re.IGNORECASE),  # "Ft - Ben -VALUE"
+    re.compile(r'ft\s*-\s*ben\s+[:-]?\s*(.+)', re.IGNORECASE),  # "Ft - Ben VALUE"
+    re.compile(r'beneficiary\s*[:-]?\s*(.+)', re.IGNORECASE),  # "Beneficiary: VALUE"
+)
+# "Ben - VALUE", then "Ben: VALUE" / "Ben VALUE", only tried when the line has no "beneficiary"
+_SHORT_BEN_PATTERNS = (
+    re.compile(r'\bben\s*-\s*(.+)', re.IGNORECASE),
+    re.compile(r'\bben\s*[:-]?\s*(.+)', re.IGNORECASE),
+)
+
+# Match PDF format: 14,700.00 (comma=thousands separator, dot=decimal) or 700.00
+# Signed amount with optional thousands separators. The two branches can't both match at
+# one position (grouped needs a comma, plain doesn't allow one), so no backtracking between them.
+_AMOUNT_RE = re.compile(r"-?(?:\d{1,3}(?:,\d{3})+|\d+)\.\d{2}")
+# Opening balance amount. The "$" only anchors the second alternative, as it always has;
+# kept as-is because anchoring both would change which amount is picked.
+_AMOUNT_EOL_RE = re.compile(r"-?\d{1,3}(?:,\d{3})*\.\d{2}|-?\d+\.\d{2}$")
+_BANK_AMOUNT_RE = re.compile(r"[\d,]+\.\d{2}")
+# POS transaction line: date, then the rest of the line (where the amounts are)
+_TXN_LINE_RE = re.compile(r"(?P<date>\d{1,2}-[A-Za-z]{3}-\d{2})(?P<body>.*)")
+_BANK_DATE_RE = re.compile(r"\d{2}-[A-Za-z]{3}-\d{2}")
+# Mixed parser transaction date (one- or two-digit day)
+_DATE_RE = re.compile(r"(\d{1,2}-[A-Za-z]{3}-\d{2})")
+
+# Any run of non-alphanumerics (underscores included) collapses to a single "_"
+_NON_ALNUM_RE = re.compile(r"[^A-Za-z0-9]+")
+
 # --------------------------------------------------------------------
 #  UTILS
 # --------------------------------------------------------------------
 
-def clean_amount(x):
-    """Convert string amount to float, handling PDF format: 14,700.00 (comma=thousands, dot=decimal)"""
-    if not x:
-        return 0.0
-    if isinstance(x, (int, float)):
-        return float(x)
-    x_str = str(x).strip()
-    # PDF format: 14,700.00 (comma for thousands, dot for decimal)
-    # Remove comma (thousands separator), keep dot as decimal
-    x_str = x_str.replace(",", "")
-    try:
-        return float(x_str)
-    except:
-        return 0.0
+_COMMA_STRIP = str.maketrans("", "", ",")
+
+
+def _fast_amount(s):
+    """Parse an amount already matched by an amount regex (digits, commas, dot, sign) - no validation"""
+    return float(s.translate(_COMMA_STRIP)) if s else 0.0
 
 
+@lru_cache(maxsize=128)
 def clean_filename_value(value):
     """Clean value for use in filename"""
-    value = re.sub(r"[^\x00-\x7F]+", "", value)
-    value = re.sub(r"[^A-Za-z0-9]+", "_", value)
-    value = re.sub(r"_+", "_", value)
-    return value.strip("_")
+    if not value.isascii():  # Most names are plain ASCII and skip the codec round-trip
+        value = value.encode("ascii", "ignore").decode("ascii")
+    return _NON_ALNUM_RE.sub("_", value).strip("_")
 
 
-def extract_by_order_of(line):
-    """Extract ByOrderOf value from line using various patterns"""
-    if not line:
-        return ""
-    
-    txt = line.lower().strip()
-    line_original = line.strip()
-    
-    # Pattern: "Ft - By Order Of VALUE" (case insensitive, flexible spacing)
-    # Match: "ft - by order of", "ft- by order of", "ft -by order of", etc.
-    pattern = re.search(r'ft\s*-\s*by\s+order\s+of\s*[:-]?\s*(.+)', txt, re.IGNORECASE)
-    if pattern:
-        value = pattern.group(1).strip().lstrip("-:").strip()
-        if value:
-            return value
-    
-    # Pattern: "By Order Of: VALUE" or "By Order Of VALUE" (case insensitive)
-    pattern = re.search(r'by\s+order\s+of\s*[:-]?\s*(.+)', txt, re.IGNORECASE)
-    if pattern:
-        value = pattern.group(1).strip().lstrip("-:").strip()
-        if value:
-            return value
-    
-    # Pattern: "Order Of: VALUE" or "Order Of VALUE" (but not "By Order Of")
-    if "by order of" not in txt:
-        pattern = re.search(r'order\s+of\s*[:-]?\s*(.+)', txt, re.IGNORECASE)
-        if pattern:
-            value = pattern.group(1).strip().lstrip("-:").strip()
+def _iter_page_texts(pdf_path):
+    """
+    Yield the text of each page in order.
+    The document is opened as a PDF (no format sniffing), read lazily page by page,
+    and closed as soon as the last page is read. Pages are read serially: uploads
+    already run in parallel in the conversion pool (see _convert_in_pool).
+    """
+    with fitz.open(pdf_path, filetype="pdf") as doc:
+        for page in doc:
+            yield page.get_text("text", flags=TEXT_FLAGS)
+
+
+# Money columns are held as floats (None = blank) while parsing and formatted once on output
+_MONEY_KEYS = ("Debit", "Kredi", "Balance", "Closing Balance", "Difference")
+
+
+def _format_money(rows):
+    """Format the float money columns of parsed rows as 14,700.00 strings ("" for None)"""
+    for row in rows:
+        for key in _MONEY_KEYS:
+            value = row[key]
+            row[key] = "" if value is None else f"{value:,.2f}"
+
+
+# Output column order shared by all converters
+CSV_COLUMNS = ["SDate", "Pershkrimi", "TYPE", "ByOrderOf", "Beneficiary", "Debit", "Kredi", "Balance", "Closing Balance", "Difference"]
+# Projects a row dict onto a CSV_COLUMNS-ordered tuple in C (every parser fills all columns)
+_ROW_VALUES = itemgetter(*CSV_COLUMNS)
+
+
+def _write_csv(rows, out_file):
+    """
+    Write parsed rows in CSV_COLUMNS order, every field quoted (same layout pandas produced).
+    out_file is a path, or a binary file object (e.g. BytesIO) that receives the UTF-8 CSV.
+    """
+    if isinstance(out_file, str):
+        # 1 MiB buffer: a long statement goes out in a few write() calls instead of one per 8 KiB
+        with open(out_file, "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+            _write_rows(f, rows)
+    else:
+        f = io.TextIOWrapper(out_file, encoding="utf-8", newline="")
+        _write_rows(f, rows)
+        f.flush()
+        f.detach()  # Leave out_file open for the caller
+
+
+def _quote_row(values):
+    """One CSV line with every field quoted, exactly as csv.QUOTE_ALL writes string fields"""
+    return '"' + '","'.join([v.replace('"', '""') for v in values]) + '"' + os.linesep
+
+
+def _write_rows(f, rows):
+    # Fields are all strings by now, so quote-all needs no csv.writer dispatch per field
+    f.write(_quote_row(CSV_COLUMNS))
+    f.writelines(map(_quote_row, map(_ROW_VALUES, rows)))
+
+
+def _opening_rows(opening_balance):
+    """The "Opening Balance" row that leads every CSV, as a list of 0 or 1 rows"""
+    if opening_balance is None:
+        return []
+    balance = f"{opening_balance:,.2f}"
+    return [{
+        "SDate": "",
+        "Pershkrimi": "Opening Balance",
+        "TYPE": "",
+        "ByOrderOf": "",
+        "Beneficiary": "",
+        "Debit": "",
+        "Kredi": "",
+        "Balance": balance,
+        "Closing Balance": balance,
+        "Difference": "0.00"
+    }]
+
+
+def _save_csv(rows, filename, output=None):
+    """
+    Without output, save rows to RESULT_FOLDER/filename and return that path.
+    With a binary file object as output, write the CSV into it instead (no server
+    copy) and return filename, e.g. to use as the download name.
+    """
+    if output is not None:
+        _write_csv(rows, output)
+        return filename
+    out_file = os.path.join(RESULT_FOLDER, filename)
+    _write_csv(rows, out_file)
+    return out_file
+
+
+def _iter_lines(page_texts):
+    """
+    Yield the text lines of a PDF page by page, without building the full text.
+    Lines are identical to "".join(page_texts).split("\n"): a line cut by a page
+    break is carried over and joined with the start of the next page.
+    """
+    carry = ""
+    for text in page_texts:
+        parts = text.split("\n")
+        parts[0] = carry + parts[0]
+        carry = parts.pop()
+        yield from parts
+    yield carry
+
+
+def _with_next(lines):
+    """Yield (line, next_line) pairs; next_line is None for the last line"""
+    it = iter(lines)
+    prev = next(it, None)
+    if prev is None:
+        return
+    for line in it:
+        yield prev, line
+        prev = line
+    yield prev, None
+
+
+def _first_value(patterns, txt):
+    """Value captured by the first of patterns that yields a non-empty one ("" if none)"""
+    for pattern in patterns:
+        m = pattern.search(txt)
+        if m:
+            value = m.group(1).strip().lstrip("-:").strip()
             if value:
                 return value
-    
     return ""
 
 
-def extract_beneficiary(line):
-    """Extract Beneficiary value from line using various patterns"""
+def extract_by_order_of(line, low=None):
+    """
+    Extract ByOrderOf value from line using various patterns.
+    Callers that already lowercased the line can pass it as low to skip a second lower().
+    """
     if not line:
         return ""
-    
-    txt = line.lower().strip()
-    line_original = line.strip()
-    
-    # Pattern: "Ft - Ben -VALUE" or "Ft - Ben - VALUE" (case insensitive, flexible spacing)
-    # This handles "Ft - Ben -MC DONALD S  SHPK" -> extracts "MC DONALD S  SHPK"
-    pattern = re.search(r'ft\s*-\s*ben\s*-\s*(.+)', txt, re.IGNORECASE)
-    if pattern:
-        value = pattern.group(1).strip().lstrip("-:").strip()
-        if value:
-            return value
-    
-    # Pattern: "Ft - Ben VALUE" (without dash after ben)
-    pattern = re.search(r'ft\s*-\s*ben\s+[:-]?\s*(.+)', txt, re.IGNORECASE)
-    if pattern:
-        value = pattern.group(1).strip().lstrip("-:").strip()
-        if value:
-            return value
-    
-    # Pattern: "Beneficiary: VALUE" or "Beneficiary VALUE" (case insensitive)
-    pattern = re.search(r'beneficiary\s*[:-]?\s*(.+)', txt, re.IGNORECASE)
-    if pattern:
-        value = pattern.group(1).strip().lstrip("-:").strip()
-        if value:
-            return value
-    
-    # Pattern: "Ben: VALUE" or "Ben - VALUE" or "Ben VALUE" (but not "Beneficiary")
-    if "beneficiary" not in txt:
-        # Try "Ben -" pattern first
-        pattern = re.search(r'\bben\s*-\s*(.+)', txt, re.IGNORECASE)
-        if pattern:
-            value = pattern.group(1).strip().lstrip("-:").strip()
-            if value:
-                return value
-        
-        # Try "Ben:" or "Ben " pattern
-        pattern = re.search(r'\bben\s*[:-]?\s*(.+)', txt, re.IGNORECASE)
-        if pattern:
-            value = pattern.group(1).strip().lstrip("-:").strip()
-            if value:
-                return value
-    
-    return ""
+
+    txt = (line.lower() if low is None else low).strip()
+    # Every branch needs "order" - skip the regex engine on the common non-matching line
+    if "order" not in txt:
+        return ""
+
+    value = _first_value(_BY_ORDER_PATTERNS, txt)
+    if not value and "by order of" not in txt:
+        value = _first_value(_ORDER_OF_PATTERNS, txt)
+    return value
+
+
+def extract_beneficiary(line, low=None):
+    """
+    Extract Beneficiary value from line using various patterns.
+    Callers that already lowercased the line can pass it as low to skip a second lower().
+    """
+    if not line:
+        return ""
+
+    txt = (line.lower() if low is None else low).strip()
+    # Every branch needs "ben" - skip the regex engine on the common non-matching line
+    if "ben" not in txt:
+        return ""
+
+    # e.g. "Ft - Ben -MC DONALD S  SHPK" -> "mc donald s  shpk"
+    value = _first_value(_BEN_PATTERNS, txt)
+    if not value and "beneficiary" not in txt:
+        value = _first_value(_SHORT_BEN_PATTERNS, txt)
+    return value
 
 # --------------------------------------------------------------------
 #  POS PARSER
 # --------------------------------------------------------------------
 
-def convert_pos_pdf_to_csv(pdf_path, original_filename=None):
+# Continuation-line TYPE detection, checked in order: (required substrings, TYPE, is_credit)
+_TYPE_KEYWORDS = (
+    (("settlement",), "SETTLEMENT", True),
+    (("commission",), "COMMISSION", False),
+    (("withdrawal",), "CASH WITHDRAWAL", False),
+    (("cash", "deposit"), "CASH DEPOSIT", True),
+)
+# TYPE -> is_credit, for parsers that already know the TYPE
+_TYPE_IS_CREDIT = {tx_type: is_credit for _, tx_type, is_credit in _TYPE_KEYWORDS}
+
+
+def _find_type(low):
+    """TYPE of the first _TYPE_KEYWORDS entry whose substrings are all in the lowercased line ("" if none)"""
+    for keywords, tx_type, _ in _TYPE_KEYWORDS:
+        if all(kw in low for kw in keywords):
+            return tx_type
+    return ""
+
+
+def _debit_credit(tx_type, amount):
+    """(debit, credit) values of a POS amount by TYPE; (0.0, 0.0) for an unknown TYPE"""
+    is_credit = _TYPE_IS_CREDIT.get(tx_type)
+    if is_credit is None:
+        return 0.0, 0.0
+    amount = abs(amount)
+    return (0.0, amount) if is_credit else (amount, 0.0)
+
+
+def _charge(current, openings, debit_val, credit_val):
+    """
+    Record a POS transaction's Credit - Debit against the latest opening balance.
+    Nothing is charged before an opening balance has been seen, and a charge made
+    after a newer opening balance starts over from it. Balance itself is filled in
+    afterwards by _fill_balances.
+    """
+    if not openings:
+        return
+    index = len(openings) - 1
+    if current["_delta"] is None or current["_opening"] != index:
+        current["_delta"] = 0.0
+        current["_opening"] = index
+    current["_delta"] += credit_val - debit_val
+
+
+def _fill_balances(rows, openings):
+    """
+    Single prefix-sum pass over the parsed POS rows:
+    Balance = Opening Balance + running sum of (Credit - Debit), restarting at each
+    opening balance, and Difference = Balance - Closing Balance where the PDF has one.
+    """
+    segment = running = None
+    for row in rows:
+        delta = row.pop("_delta")
+        index = row.pop("_opening", None)
+        if delta is None:
+            continue
+        if index != segment:
+            segment = index
+            running = openings[index]
+        running += delta
+        row["Balance"] = running
+        if row["Closing Balance"] is not None:
+            row["Difference"] = running - row["Closing Balance"]
+
+
+def _first_amount(current):
+    """
+    First amount of a POS transaction: from its date line, else from the earliest
+    continuation line that has one. Continuation lines are only scanned when needed.
+    """
+    if current["_amounts"]:
+        return current["_amounts"][0]
+    for part in current["_desc_parts"][1:]:
+        m = _AMOUNT_RE.search(part)
+        if m:
+            return m.group(0)
+    return None
+
+
+def _apply_type(current, low, openings):
+    """
+    Set TYPE on a POS transaction from a continuation line and fill in
+    Debit/Kredi (and charge the balance) if the date line couldn't.
+    """
+    tx_type = _find_type(low)
+    if not tx_type:
+        return
+    is_credit = _TYPE_IS_CREDIT[tx_type]
+
+    current["TYPE"] = tx_type
+    # If we haven't assigned debit/credit yet, do it now
+    if not current["Kredi"] and not current["Debit"]:
+        first = _first_amount(current)
+        if first:
+            amount = _fast_amount(first)
+            # Calculate balance: Opening Balance - Debit + Credit
+            if is_credit:
+                current["Kredi"] = amount or None
+                current["Debit"] = None
+                _charge(current, openings, 0.0, amount)
+            else:
+                current["Debit"] = amount or None
+                current["Kredi"] = None
+                _charge(current, openings, amount, 0.0)
+    elif current["_delta"] is None and current["Balance"] is None:
+        # TYPE found but balance not calculated yet - recalculate
+        _charge(current, openings, current["Debit"] or 0.0, current["Kredi"] or 0.0)
+
+
+def convert_pos_pdf_to_csv(pdf_path, original_filename=None, output=None, ts=None):
     """
     Convert POS merchant settlement PDF to CSV.
     Balance formula: Opening Balance - Debit + Credit = New Balance
+    Returns the CSV path, or its filename when written to output (see _save_csv).
     """
-    doc = fitz.open(pdf_path)
     rows = []
     current = None
     opening_balance = None
-    running_balance = None  # This will track: Opening Balance - Debit + Credit
-
-    # Match PDF format: 14,700.00 (comma=thousands separator, dot=decimal) or 700.00
-    AMOUNT_REGEX = r"[-]?\d{1,3}(?:,\d{3})*\.\d{2}|[-]?\d+\.\d{2}"
+    # Every opening balance seen; rows are charged against the latest one and the
+    # running balance (Opening Balance - Debit + Credit) is summed after parsing
+    openings = []
 
-    def extract_amounts(line):
-        return re.findall(AMOUNT_REGEX, line)
+    def flush():
+        nonlocal current
+        if current:
+            # Finalize balance if not already calculated
+            if current["_delta"] is None and current["Balance"] is None:
+                _charge(current, openings, current["Debit"] or 0.0, current["Kredi"] or 0.0)
 
-    lines = []
-    for page in doc:
-        lines.extend(page.get_text("text").split("\n"))
+            # Build the description once instead of growing a string per line
+            current["Pershkrimi"] = " ".join(current.pop("_desc_parts"))
+            del current["_amounts"]
+            rows.append(current)
+        current = None
 
-    for i, raw in enumerate(lines):
-        raw = raw.strip()
-        low = raw.lower()
+    # Stream stripped lines, each lowercased once, with a one-line lookahead
+    # (the line after a date line carries its TYPE). The lookahead crosses page
+    # breaks: a date line at the bottom of a page takes its TYPE from the first
+    # line of the next page. E.g. page 1 ending "05-Oct-25 POS 100.00 900.00" and
+    # page 2 starting "Commission fee" gives TYPE COMMISSION with Debit 100.00
+    # (each page used to end in an empty line, which left it a sign-inferred credit).
+    lines = map(str.strip, _iter_lines(_iter_page_texts(pdf_path)))
+    for (raw, low), next_pair in _with_next((line, line.lower()) for line in lines):
 
         # OPENING BALANCE
-        if raw.lower().startswith("opening balance"):
-            m = re.search(AMOUNT_REGEX + r"$", raw)
+        if low.startswith("opening balance"):
+            m = _AMOUNT_EOL_RE.search(raw)
             if m:
-                opening_balance = clean_amount(m.group(0))
-                running_balance = opening_balance
+                opening_balance = _fast_amount(m.group(0))
+                openings.append(opening_balance)
             continue
 
         # New transaction
-        date_match = re.match(r"(\d{1,2}-[A-Za-z]{3}-\d{2})", raw)
+        date_match = _TXN_LINE_RE.match(raw)
         if date_match:
             # Save previous transaction (ensure balance is calculated)
-            if current:
-                # Finalize balance if not already calculated
-                if not current["Balance"] and running_balance is not None:
-                    debit_val = clean_amount(current["Debit"]) if current["Debit"] else 0.0
-                    credit_val = clean_amount(current["Kredi"]) if current["Kredi"] else 0.0
-                    calculated_balance = running_balance - debit_val + credit_val
-                    current["Balance"] = f"{calculated_balance:,.2f}"
-                    
-                    # Calculate difference if closing balance exists
-                    if current["Closing Balance"]:
-                        closing_val = clean_amount(current["Closing Balance"])
-                        diff = calculated_balance - closing_val
-                        current["Difference"] = f"{diff:,.2f}"
-                    
-                    running_balance = calculated_balance
-                rows.append(current)
+            flush()
 
             # Extract amounts from the transaction line
-            amounts = extract_amounts(raw)
+            amounts = _AMOUNT_RE.findall(date_match["body"])
             
             current = {
-                "SDate": date_match.group(1),
-                "Pershkrimi": raw,  # Will accumulate all text here
+                "SDate": date_match["date"],
+                "Pershkrimi": "",  # Joined from _desc_parts on flush
                 "TYPE": "",
                 "ByOrderOf": "",
                 "Beneficiary": "",
-                "Debit": "",
-                "Kredi": "",
-                "Balance": "",  # Calculated: Opening Balance - Debit + Credit
-                "Closing Balance": "",  # From PDF/CSV
-                "Difference": ""  # Should be 0
+                # Money fields stay floats (None = blank) until _format_money
+                "Debit": None,
+                "Kredi": None,
+                "Balance": None,  # Calculated: Opening Balance - Debit + Credit
+                "Closing Balance": None,  # From PDF/CSV
+                "Difference": None,  # Should be 0
+                "_delta": None,  # Credit - Debit charged so far, summed by _fill_balances
+                "_desc_parts": [raw],  # All text lines of the transaction
+                "_amounts": amounts,  # Amounts on the date line (see _first_amount)
             }
 
             # Determine transaction type from next line
-            tx_type = ""
-            if i + 1 < len(lines):
-                next_line = lines[i + 1].strip().lower()
-                if "settlement" in next_line:
-                    tx_type = "SETTLEMENT"
-                elif "commission" in next_line:
-                    tx_type = "COMMISSION"
-                elif "cash withdrawal" in next_line or "withdrawal" in next_line:
-                    tx_type = "CASH WITHDRAWAL"
-                elif "cash deposit" in next_line or ("cash" in next_line and "deposit" in next_line):
-                    tx_type = "CASH DEPOSIT"
+            tx_type = _find_type(next_pair[1]) if next_pair is not None else ""
             
             current["TYPE"] = tx_type
 
+            # Debit or credit side, decided once from the TYPE (None = no TYPE yet)
+            is_credit = _TYPE_IS_CREDIT.get(tx_type)
+
             # Parse amounts: typically 2 amounts (transaction amount, balance)
             if len(amounts) >= 2:
                 # First amount is the transaction amount
-                trans_amount = clean_amount(amounts[0])
+                trans_amount = _fast_amount(amounts[0])
                 # Second amount is the balance from PDF
-                pdf_balance = clean_amount(amounts[1])
-                
-                # Assign debit/credit based on type
-                if tx_type == "SETTLEMENT" or tx_type == "CASH DEPOSIT":
-                    current["Kredi"] = f"{trans_amount:,.2f}" if trans_amount else ""
-                    current["Debit"] = ""
-                elif tx_type == "COMMISSION" or tx_type == "CASH WITHDRAWAL":
-                    current["Debit"] = f"{trans_amount:,.2f}" if trans_amount else ""
-                    current["Kredi"] = ""
+                pdf_balance = _fast_amount(amounts[1])
+
+                if is_credit is None:
+                    # If no type, infer from amount sign; the amount is stored unsigned
+                    is_credit = trans_amount >= 0
+                    shown = abs(trans_amount)
                 else:
-                    # If no type, try to infer from amount sign or context
-                    if trans_amount < 0:
-                        current["Debit"] = f"{abs(trans_amount):,.2f}"
-                        current["Kredi"] = ""
-                    else:
-                        current["Kredi"] = f"{trans_amount:,.2f}" if trans_amount else ""
-                        current["Debit"] = ""
+                    shown = trans_amount
+                # Debit values are always positive in the balance, whatever the PDF's sign
+                debit_val, credit_val = (0.0, abs(trans_amount)) if is_credit else (abs(trans_amount), 0.0)
+                current["Kredi" if is_credit else "Debit"] = shown or None
 
                 # Store closing balance from PDF (source of truth)
                 if pdf_balance:
-                    current["Closing Balance"] = f"{pdf_balance:,.2f}"
+                    current["Closing Balance"] = pdf_balance
                 
                 # Calculate balance: Opening Balance - Debit + Credit
-                # Note: Debit values are always positive (amounts are stored as positive), so use abs() if needed
-                if running_balance is not None:
-                    if tx_type == "COMMISSION" or tx_type == "CASH WITHDRAWAL":
-                        debit_val = abs(trans_amount)
-                        credit_val = 0.0
-                    elif tx_type == "SETTLEMENT" or tx_type == "CASH DEPOSIT":
-                        debit_val = 0.0
-                        credit_val = abs(trans_amount)
-                    elif trans_amount < 0:
-                        debit_val = abs(trans_amount)
-                        credit_val = 0.0
-                    else:
-                        debit_val = 0.0
-                        credit_val = abs(trans_amount)
-                    calculated_balance = running_balance - debit_val + credit_val
-                    current["Balance"] = f"{calculated_balance:,.2f}"
-                    
-                    # Calculate difference: should be 0 if calculations are correct
-                    if pdf_balance:
-                        diff = calculated_balance - pdf_balance
-                        # Round to 2 decimal places to handle floating point precision
-                        diff_rounded = round(diff, 2)
-                        current["Difference"] = f"{diff_rounded:,.2f}"
-                    else:
-                        current["Difference"] = ""
-                    
-                    # Update running balance for next transaction (use calculated)
-                    running_balance = calculated_balance
+                if openings:
+                    # Difference against the PDF balance should be 0 if calculations are correct
+                    _charge(current, openings, debit_val, credit_val)
                 elif pdf_balance:
                     # No running balance, use PDF balance
-                    current["Balance"] = f"{pdf_balance:,.2f}"
-                    current["Difference"] = "0.00"
+                    current["Balance"] = pdf_balance
+                    current["Difference"] = 0.0
 
             elif len(amounts) == 1:
                 # Only one amount found - use type to determine debit/credit
-                trans_amount = clean_amount(amounts[0])
-                if tx_type == "SETTLEMENT" or tx_type == "CASH DEPOSIT":
-                    current["Kredi"] = f"{trans_amount:,.2f}" if trans_amount else ""
-                    current["Debit"] = ""
-                elif tx_type == "COMMISSION" or tx_type == "CASH WITHDRAWAL":
-                    current["Debit"] = f"{trans_amount:,.2f}" if trans_amount else ""
-                    current["Kredi"] = ""
+                trans_amount = _fast_amount(amounts[0])
+                if is_credit is None:
+                    # No type: nothing to show, and the balance is charged nothing
+                    debit_val = credit_val = 0.0
+                else:
+                    debit_val, credit_val = (0.0, abs(trans_amount)) if is_credit else (abs(trans_amount), 0.0)
+                    current["Kredi" if is_credit else "Debit"] = trans_amount or None
                 
                 # Calculate balance
-                if running_balance is not None:
-                    if tx_type == "COMMISSION" or tx_type == "CASH WITHDRAWAL":
-                        debit_val = abs(trans_amount)
-                        credit_val = 0.0
-                    elif tx_type == "SETTLEMENT" or tx_type == "CASH DEPOSIT":
-                        debit_val = 0.0
-                        credit_val = abs(trans_amount)
-                    else:
-                        debit_val = 0.0
-                        credit_val = 0.0
-                    calculated_balance = running_balance - debit_val + credit_val
-                    current["Balance"] = f"{calculated_balance:,.2f}"
-                    current["Closing Balance"] = ""  # No closing balance from PDF
-                    current["Difference"] = ""
-                    running_balance = calculated_balance
+                if openings:
+                    # No closing balance from PDF, so no Difference either
+                    _charge(current, openings, debit_val, credit_val)
 
             continue
 
         # Additional lines - append to description and extract metadata
         if current:
             # Extract ByOrderOf using unified extraction if not already found
-            if not current["ByOrderOf"]:
-                by_order = extract_by_order_of(raw)
+            if not current["ByOrderOf"] and "order" in low:
+                by_order = extract_by_order_of(raw, low)
                 if by_order:
                     current["ByOrderOf"] = by_order
             
             # Extract Beneficiary using unified extraction if not already found
-            if not current["Beneficiary"]:
-                beneficiary = extract_beneficiary(raw)
+            if not current["Beneficiary"] and "ben" in low:
+                beneficiary = extract_beneficiary(raw, low)
                 if beneficiary:
                     current["Beneficiary"] = beneficiary
             
-            current["Pershkrimi"] += " " + raw
+            current["_desc_parts"].append(raw)
 
             # Also check for TYPE in continuation lines (only if not already set)
-            if "settlement" in low and not current["TYPE"]:
-                current["TYPE"] = "SETTLEMENT"
-                # If we haven't assigned debit/credit yet, do it now
-                if not current["Kredi"] and not current["Debit"]:
-                    amounts = extract_amounts(current["Pershkrimi"])
-                    if amounts:
-                        amount = clean_amount(amounts[0])
-                        current["Kredi"] = f"{amount:,.2f}" if amount else ""
-                        current["Debit"] = ""
-                        # Calculate balance: Opening Balance - Debit + Credit
-                        if running_balance is not None:
-                            calculated_balance = running_balance - 0.0 + amount
-                            current["Balance"] = f"{calculated_balance:,.2f}"
-                            if current["Closing Balance"]:
-                                closing_val = clean_amount(current["Closing Balance"])
-                                diff = calculated_balance - closing_val
-                                current["Difference"] = f"{diff:,.2f}"
-                            running_balance = calculated_balance
-                elif not current["Balance"] and running_balance is not None:
-                    # TYPE found but balance not calculated yet - recalculate
-                    debit_val = clean_amount(current["Debit"]) if current["Debit"] else 0.0
-                    credit_val = clean_amount(current["Kredi"]) if current["Kredi"] else 0.0
-                    calculated_balance = running_balance - debit_val + credit_val
-                    current["Balance"] = f"{calculated_balance:,.2f}"
-                    if current["Closing Balance"]:
-                        closing_val = clean_amount(current["Closing Balance"])
-                        diff = calculated_balance - closing_val
-                        current["Difference"] = f"{diff:,.2f}"
-                    running_balance = calculated_balance
-            elif "commission" in low and not current["TYPE"]:
-                current["TYPE"] = "COMMISSION"
-                # If we haven't assigned debit/credit yet, do it now
-                if not current["Kredi"] and not current["Debit"]:
-                    amounts = extract_amounts(current["Pershkrimi"])
-                    if amounts:
-                        amount = clean_amount(amounts[0])
-                        current["Debit"] = f"{amount:,.2f}" if amount else ""
-                        current["Kredi"] = ""
-                        # Calculate balance: Opening Balance - Debit + Credit
-                        if running_balance is not None:
-                            calculated_balance = running_balance - amount + 0.0
-                            current["Balance"] = f"{calculated_balance:,.2f}"
-                            if current["Closing Balance"]:
-                                closing_val = clean_amount(current["Closing Balance"])
-                                diff = calculated_balance - closing_val
-                                current["Difference"] = f"{diff:,.2f}"
-                            running_balance = calculated_balance
-                elif not current["Balance"] and running_balance is not None:
-                    # TYPE found but balance not calculated yet - recalculate
-                    debit_val = clean_amount(current["Debit"]) if current["Debit"] else 0.0
-                    credit_val = clean_amount(current["Kredi"]) if current["Kredi"] else 0.0
-                    calculated_balance = running_balance - debit_val + credit_val
-                    current["Balance"] = f"{calculated_balance:,.2f}"
-                    if current["Closing Balance"]:
-                        closing_val = clean_amount(current["Closing Balance"])
-                        diff = calculated_balance - closing_val
-                        current["Difference"] = f"{diff:,.2f}"
-                    running_balance = calculated_balance
-            elif ("cash withdrawal" in low or "withdrawal" in low) and not current["TYPE"]:
-                current["TYPE"] = "CASH WITHDRAWAL"
-                # If we haven't assigned debit/credit yet, do it now
-                if not current["Kredi"] and not current["Debit"]:
-                    amounts = extract_amounts(current["Pershkrimi"])
-                    if amounts:
-                        amount = clean_amount(amounts[0])
-                        current["Debit"] = f"{amount:,.2f}" if amount else ""
-                        current["Kredi"] = ""
-                        # Calculate balance: Opening Balance - Debit + Credit
-                        if running_balance is not None:
-                            calculated_balance = running_balance - amount + 0.0
-                            current["Balance"] = f"{calculated_balance:,.2f}"
-                            if current["Closing Balance"]:
-                                closing_val = clean_amount(current["Closing Balance"])
-                                diff = calculated_balance - closing_val
-                                current["Difference"] = f"{diff:,.2f}"
-                            running_balance = calculated_balance
-                elif not current["Balance"] and running_balance is not None:
-                    # TYPE found but balance not calculated yet - recalculate
-                    debit_val = clean_amount(current["Debit"]) if current["Debit"] else 0.0
-                    credit_val = clean_amount(current["Kredi"]) if current["Kredi"] else 0.0
-                    calculated_balance = running_balance - debit_val + credit_val
-                    current["Balance"] = f"{calculated_balance:,.2f}"
-                    if current["Closing Balance"]:
-                        closing_val = clean_amount(current["Closing Balance"])
-                        diff = calculated_balance - closing_val
-                        current["Difference"] = f"{diff:,.2f}"
-                    running_balance = calculated_balance
-            elif ("cash deposit" in low or ("cash" in low and "deposit" in low)) and not current["TYPE"]:
-                current["TYPE"] = "CASH DEPOSIT"
-                # If we haven't assigned debit/credit yet, do it now
-                if not current["Kredi"] and not current["Debit"]:
-                    amounts = extract_amounts(current["Pershkrimi"])
-                    if amounts:
-                        amount = clean_amount(amounts[0])
-                        current["Kredi"] = f"{amount:,.2f}" if amount else ""
-                        current["Debit"] = ""
-                        # Calculate balance: Opening Balance - Debit + Credit
-                        if running_balance is not None:
-                            calculated_balance = running_balance - 0.0 + amount
-                            current["Balance"] = f"{calculated_balance:,.2f}"
-                            if current["Closing Balance"]:
-                                closing_val = clean_amount(current["Closing Balance"])
-                                diff = calculated_balance - closing_val
-                                current["Difference"] = f"{diff:,.2f}"
-                            running_balance = calculated_balance
-                elif not current["Balance"] and running_balance is not None:
-                    # TYPE found but balance not calculated yet - recalculate
-                    debit_val = clean_amount(current["Debit"]) if current["Debit"] else 0.0
-                    credit_val = clean_amount(current["Kredi"]) if current["Kredi"] else 0.0
-                    calculated_balance = running_balance - debit_val + credit_val
-                    current["Balance"] = f"{calculated_balance:,.2f}"
-                    if current["Closing Balance"]:
-                        closing_val = clean_amount(current["Closing Balance"])
-                        diff = calculated_balance - closing_val
-                        current["Difference"] = f"{diff:,.2f}"
-                    running_balance = calculated_balance
-
-        # Save last transaction (ensure balance is calculated)
-        if current:
-            # Finalize balance if not already calculated
-            if not current["Balance"] and running_balance is not None:
-                debit_val = clean_amount(current["Debit"]) if current["Debit"] else 0.0
-                credit_val = clean_amount(current["Kredi"]) if current["Kredi"] else 0.0
-                calculated_balance = running_balance - debit_val + credit_val
-                current["Balance"] = f"{calculated_balance:,.2f}"
-                if current["Closing Balance"]:
-                    closing_val = clean_amount(current["Closing Balance"])
-                    diff = calculated_balance - closing_val
-                    current["Difference"] = f"{diff:,.2f}"
-                running_balance = calculated_balance
-            rows.append(current)
+            if not current["TYPE"]:
+                _apply_type(current, low, openings)
 
-    # Add opening balance row at the beginning
-    if opening_balance is not None:
-        rows.insert(0, {
-            "SDate": "",
-            "Pershkrimi": "Opening Balance",
-            "TYPE": "",
-            "ByOrderOf": "",
-            "Beneficiary": "",
-            "Debit": "",
-            "Kredi": "",
-            "Balance": f"{opening_balance:,.2f}",
-            "Closing Balance": f"{opening_balance:,.2f}",
-            "Difference": "0.00"
-        })
+    # Save last transaction (ensure balance is calculated)
+    flush()
+    _fill_balances(rows, openings)
 
-    # Save CSV with proper column order
-    df = pd.DataFrame(rows)
-    # Ensure columns are in the correct order: SDate, Pershkrimi, TYPE, ByOrderOf, Beneficiary, Debit, Kredi, Balance, Closing Balance, Difference
-    columns_order = ["SDate", "Pershkrimi", "TYPE", "ByOrderOf", "Beneficiary", "Debit", "Kredi", "Balance", "Closing Balance", "Difference"]
-    df = df[[col for col in columns_order if col in df.columns]]
-    
-    # Generate filename: original_filename + date_processed
+    _format_money(rows)
+
+    # Opening balance row goes first: chained in front at write time instead of rows.insert(0, ...)
+    rows = chain(_opening_rows(opening_balance), rows)
+
+    # Generate filename: original_filename + date_processed (ts is passed in by the upload route)
+    date_processed = ts or datetime.now().strftime("%Y%m%d_%H%M%S")
     if original_filename:
         # Get base name without extension
         base_name = os.path.splitext(os.path.basename(original_filename))[0]
         base_name_clean = clean_filename_value(base_name)
-        date_processed = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{base_name_clean}_{date_processed}.csv"
     else:
-        filename = "bkt_pos_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv"
+        filename = "bkt_pos_" + date_processed + ".csv"
     
-    out_file = os.path.join(RESULT_FOLDER, filename)
-    df.to_csv(out_file, index=False, quoting=csv.QUOTE_ALL)
-    return out_file
+    # Save CSV with proper column order
+    return _save_csv(rows, filename, output)
 
 
 # --------------------------------------------------------------------
 #  BANK STATEMENT PARSER
 # --------------------------------------------------------------------
 
-def convert_bank_pdf_to_csv(pdf_path, original_filename=None):
+def convert_bank_pdf_to_csv(pdf_path, original_filename=None, output=None, ts=None):
     """
     Convert bank statement PDF to CSV.
     Balance formula: Opening Balance - Debit + Credit = New Balance
+    Returns the CSV path, or its filename when written to output (see _save_csv).
     """
-    doc = fitz.open(pdf_path)
-    full_text = ""
-    for page in doc:
-        full_text += page.get_text()
-
-    lines = full_text.split("\n")
-
-    date_pattern = re.compile(r"\d{2}-[A-Za-z]{3}-\d{2}")
-    amount_pattern = r"[\d,]+\.\d{2}"
-
     header = {
         "Name": "",
         "IBAN": "",
@@ -521,20 +572,23 @@ def convert_bank_pdf_to_csv(pdf_path, original_filename=None):
     opening_balance = None
     running_balance = None
     current = None
+    # Header fields only appear above the first transaction line
+    header_done = False
 
     def flush():
         nonlocal current, running_balance
         if current:
             # Calculate balance: Opening Balance - Debit + Credit
+            # Amounts were parsed once on the date line; no need to re-parse the strings
+            debit_val = current.pop("_debit_f")
+            credit_val = current.pop("_kredi_f")
+            closing_val = current.pop("_closing_f")
             if running_balance is not None:
-                debit_val = clean_amount(current["Debit"]) if current["Debit"] else 0.0
-                credit_val = clean_amount(current["Kredi"]) if current["Kredi"] else 0.0
                 calculated_balance = running_balance - debit_val + credit_val
                 current["Balance"] = f"{calculated_balance:,.2f}"
                 
                 # Format closing balance from PDF if available
                 if current["Closing Balance"]:
-                    closing_val = clean_amount(current["Closing Balance"])
                     current["Closing Balance"] = f"{closing_val:,.2f}"
                     # Calculate difference
                     diff = calculated_balance - closing_val
@@ -545,53 +599,74 @@ def convert_bank_pdf_to_csv(pdf_path, original_filename=None):
                 # Update running balance for next transaction (use calculated)
                 running_balance = calculated_balance
             
+            # Build the description once instead of growing a string per line
+            current["Pershkrimi"] = " | ".join(current.pop("_desc_parts"))
             transactions.append(current)
         current = None
 
-    for line in lines:
-        line = line.strip()
-
-        # HEADER
-        if line.startswith("IBAN:"):
-            header["IBAN"] = line.replace("IBAN:", "").strip()
-        elif "BIC/Swift code:" in line:
-            header["BIC"] = line.replace("BIC/Swift code:", "").strip()
-        elif "DATE OF STATEMENT" in line:
-            header["StatementDate"] = line.replace("DATE OF STATEMENT", "").strip()
-        elif "FROM(NGA DATA)" in line or "FROM" in line.upper():
-            parts = line.replace("FROM(NGA DATA):", "").replace("TO(NE DATEN):", "").replace("FROM:", "").replace("TO:", "").split()
-            if len(parts) >= 2:
-                header["FromDate"] = parts[0]
-                header["ToDate"] = parts[-1]
-        elif line.startswith("433"):
-            header["AccountNumber"] = line.strip()
-            header["Currency"] = "ALL"
-        elif "PF" in line and header["Name"] == "":
-            header["Name"] = line
+    for line in map(str.strip, _iter_lines(_iter_page_texts(pdf_path))):
+        # One lowercased copy serves every case-insensitive test below
+        low = line.lower()
+
+        # HEADER (skipped once transactions start, so descriptions can't overwrite it)
+        if not header_done:
+            if line.startswith("IBAN:"):
+                header["IBAN"] = line.replace("IBAN:", "").strip()
+            elif "BIC/Swift code:" in line:
+                header["BIC"] = line.replace("BIC/Swift code:", "").strip()
+            elif "DATE OF STATEMENT" in line:
+                header["StatementDate"] = line.replace("DATE OF STATEMENT", "").strip()
+            elif "FROM(NGA DATA)" in line or "from" in low:
+                parts = line.replace("FROM(NGA DATA):", "").replace("TO(NE DATEN):", "").replace("FROM:", "").replace("TO:", "").split()
+                if len(parts) >= 2:
+                    header["FromDate"] = parts[0]
+                    header["ToDate"] = parts[-1]
+            elif line.startswith("433"):
+                header["AccountNumber"] = line
+                header["Currency"] = "ALL"
+            elif "PF" in line and header["Name"] == "":
+                header["Name"] = line
 
         # Look for opening balance
-        if "OPENING BALANCE" in line.upper() or "OPENING" in line.upper():
-            money = re.findall(amount_pattern, line)
+        if "opening" in low:  # also covers "OPENING BALANCE"
+            money = _BANK_AMOUNT_RE.findall(line)
             if money:
-                opening_balance = clean_amount(money[-1])
+                opening_balance = _fast_amount(money[-1])
                 running_balance = opening_balance
 
         # TRANSACTIONS
-        if date_pattern.match(line[:10]):
+        # The pattern is anchored and fixed-width, so it needs no line[:10] copy; the "-"
+        # test turns away most non-date lines before entering the regex engine
+        if line[2:3] == "-" and _BANK_DATE_RE.match(line):
+            header_done = True
             flush()
 
             date = line[:10]
-            money = re.findall(amount_pattern, line)
-            desc = re.sub(amount_pattern, "", line[10:]).strip()
+            # One scan yields the amounts and, from the text between them, the description
+            matches = list(_BANK_AMOUNT_RE.finditer(line))
+            money = [m.group() for m in matches]
+            if matches and matches[0].start() < 10:
+                # An amount runs into the date; let sub() see the line the way it always has
+                desc = _BANK_AMOUNT_RE.sub("", line[10:]).strip()
+            else:
+                parts = []
+                last = 10
+                for m in matches:
+                    parts.append(line[last:m.start()])
+                    last = m.end()
+                parts.append(line[last:])
+                desc = "".join(parts).strip()
 
             debit = ""
             credit = ""
             balance = ""
+            debit_val = credit_val = 0.0
+            balance_val = None
 
             if len(money) == 1:
                 # Only one amount - need to determine if debit or credit
                 amount = money[0]
-                amount_val = clean_amount(amount)
+                amount_val = _fast_amount(amount)
                 
                 # If we have running balance, we can infer
                 if running_balance is not None:
@@ -600,52 +675,38 @@ def convert_bank_pdf_to_csv(pdf_path, original_filename=None):
                     credit = amount
                 else:
                     credit = amount
+                credit_val = amount_val
                     
             elif len(money) == 2:
                 # Two amounts: transaction amount and balance
                 amount = money[0]
                 balance = money[1]
                 
-                amount_val = clean_amount(amount)
-                balance_val = clean_amount(balance)
+                amount_val = _fast_amount(amount)
+                balance_val = _fast_amount(balance)
                 
                 # Determine if debit or credit using the formula
                 # Formula: new_balance = prev_balance - debit + credit
                 # So: diff = new_balance - prev_balance = -debit + credit
-                # If diff > 0: credit transaction
-                # If diff < 0: debit transaction
-                
+                # It's a debit only when the balance dropped by the amount; anything
+                # else (including no running balance yet) defaults to credit.
+                # Bank amounts never carry a sign, so there is no sign fallback.
+                is_debit = False
                 if running_balance is not None:
-                    # Calculate what the transaction should be
                     diff = balance_val - running_balance
-                    
-                    # If difference equals amount, it's a credit
-                    if abs(abs(diff) - amount_val) < 0.01:
-                        if diff > 0:
-                            credit = amount
-                            debit = ""
-                        else:
-                            debit = amount
-                            credit = ""
-                    else:
-                        # Use amount sign as fallback
-                        if amount_val >= 0:
-                            credit = amount
-                            debit = ""
-                        else:
-                            debit = amount.replace("-", "")
-                            credit = ""
+                    is_debit = diff <= 0 and abs(diff + amount_val) < 0.01
+                debit, credit = (amount, "") if is_debit else ("", amount)
+                if is_debit:
+                    debit_val = amount_val
                 else:
-                    # No running balance, default to credit
-                    credit = amount
-                    debit = ""
-                
+                    credit_val = amount_val
+
             else:
                 continue
 
             current = {
                 "SDate": date,
-                "Pershkrimi": desc,  # Will accumulate all text here
+                "Pershkrimi": "",  # Joined from _desc_parts on flush
                 "TYPE": "",  # Bank statements may not have explicit TYPE
                 "ByOrderOf": "",
                 "Beneficiary": "",
@@ -653,152 +714,110 @@ def convert_bank_pdf_to_csv(pdf_path, original_filename=None):
                 "Kredi": credit,
                 "Balance": "",  # Calculated: Opening Balance - Debit + Credit
                 "Closing Balance": balance,  # From PDF/CSV
-                "Difference": ""  # Should be 0
+                "Difference": "",  # Should be 0
+                "_desc_parts": [desc],  # Description, then every continuation line
+                "_debit_f": debit_val,  # Parsed amounts, popped on flush
+                "_kredi_f": credit_val,
+                "_closing_f": balance_val,
             }
 
         elif current:
-            txt = line.lower()
-            line_clean = line.strip()
-
             # Extract ByOrderOf using unified extraction if not already found
-            if not current["ByOrderOf"]:
-                by_order = extract_by_order_of(line)
+            if not current["ByOrderOf"] and "order" in low:
+                by_order = extract_by_order_of(line, low)
                 if by_order:
                     current["ByOrderOf"] = by_order
             
             # Extract Beneficiary using unified extraction if not already found
-            if not current["Beneficiary"]:
-                beneficiary = extract_beneficiary(line)
+            if not current["Beneficiary"] and "ben" in low:
+                beneficiary = extract_beneficiary(line, low)
                 if beneficiary:
                     current["Beneficiary"] = beneficiary
             
             # Always add to description for verification
-            current["Pershkrimi"] += " | " + line_clean
+            current["_desc_parts"].append(line)
 
     flush()
 
-    # Add opening balance row if found
-    if opening_balance is not None:
-        transactions.insert(0, {
-            "SDate": "",
-            "Pershkrimi": "Opening Balance",
-            "TYPE": "",
-            "ByOrderOf": "",
-            "Beneficiary": "",
-            "Debit": "",
-            "Kredi": "",
-            "Balance": f"{opening_balance:,.2f}",
-            "Closing Balance": f"{opening_balance:,.2f}",
-            "Difference": "0.00"
-        })
+    # Opening balance row (if found) goes first: chained in front at write time
+    transactions = chain(_opening_rows(opening_balance), transactions)
 
     # OUTPUT
-    # Generate filename: original_filename + date_processed
+    # Generate filename: original_filename + date_processed (ts is passed in by the upload route)
+    date_processed = ts or datetime.now().strftime("%Y%m%d_%H%M%S")
     if original_filename:
         # Get base name without extension
         base_name = os.path.splitext(os.path.basename(original_filename))[0]
         base_name_clean = clean_filename_value(base_name)
-        date_processed = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{base_name_clean}_{date_processed}.csv"
     else:
         # Fallback to old naming if no original filename provided
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         name_clean = clean_filename_value(header["Name"])
         iban_clean = clean_filename_value(header["IBAN"])
         from_clean = clean_filename_value(header["FromDate"])
         to_clean = clean_filename_value(header["ToDate"])
-        filename = f"{name_clean}_{iban_clean}_{from_clean}_{to_clean}_{timestamp}.csv"
+        filename = f"{name_clean}_{iban_clean}_{from_clean}_{to_clean}_{date_processed}.csv"
     
-    output_path = os.path.join(RESULT_FOLDER, filename)
-
-    df = pd.DataFrame(transactions)
-    # Ensure columns are in the correct order: SDate, Pershkrimi, TYPE, ByOrderOf, Beneficiary, Debit, Kredi, Balance, Closing Balance, Difference
-    columns_order = ["SDate", "Pershkrimi", "TYPE", "ByOrderOf", "Beneficiary", "Debit", "Kredi", "Balance", "Closing Balance", "Difference"]
-    df = df[[col for col in columns_order if col in df.columns]]
-    
-    df.to_csv(output_path, index=False, quoting=csv.QUOTE_ALL)
-
-    return output_path
+    # Columns: SDate, Pershkrimi, TYPE, ByOrderOf, Beneficiary, Debit, Kredi, Balance, Closing Balance, Difference
+    return _save_csv(transactions, filename, output)
 
 
 # --------------------------------------------------------------------
 #  UNIFIED MIXED PARSER (POS + Bank Transactions)
 # --------------------------------------------------------------------
 
-def convert_mixed_pdf_to_csv(pdf_path, original_filename=None):
+def convert_mixed_pdf_to_csv(pdf_path, original_filename=None, output=None, ts=None):
     """
     Convert PDF containing both POS and bank transactions to CSV.
     Detects transaction type per transaction and applies appropriate parsing logic.
     Balance formula: Opening Balance - Debit + Credit = New Balance
+    Returns the CSV path, or its filename when written to output (see _save_csv).
     """
-    doc = fitz.open(pdf_path)
-    full_text = ""
-    for page in doc:
-        full_text += page.get_text()
-    
-    lines = full_text.split("\n")
-    
-    # Match PDF format: 14,700.00 (comma=thousands separator, dot=decimal) or 700.00
-    AMOUNT_REGEX = r"[-]?\d{1,3}(?:,\d{3})*\.\d{2}|[-]?\d+\.\d{2}"
-    amount_pattern = r"[\d,]+\.\d{2}"
-    # Date pattern with capturing group for consistency
-    date_pattern = re.compile(r"(\d{2}-[A-Za-z]{3}-\d{2})")
+    # Page texts come from _iter_page_texts, streamed as stripped lines with
+    # page-break carry-over
+    lines = map(str.strip, _iter_lines(_iter_page_texts(pdf_path)))
     
     rows = []
     opening_balance = None
     running_balance = None
     current_transaction_lines = []
+    current_transaction_lows = []  # Lowercased copies, made once in the main loop
     current = None
     
-    def extract_amounts(line):
-        return re.findall(AMOUNT_REGEX, line)
-    
-    def is_pos_transaction(transaction_lines):
-        """Check if transaction has specific type keywords (POS or cash transactions)"""
-        for line in transaction_lines:
-            low = line.lower()
-            if any(keyword in low for keyword in ["settlement", "commission", "cash withdrawal", "cash deposit", "withdrawal", "deposit"]):
-                return True
-        return False
+    def classify_transaction(transaction_lows):
+        """
+        Return (is_pos, tx_type) in one pass over the lowercased lines.
+        POS (or cash) transactions mention settlement, commission, withdrawal or deposit;
+        TYPE (SETTLEMENT, COMMISSION, CASH WITHDRAWAL, CASH DEPOSIT) comes from the
+        first line matching _TYPE_KEYWORDS.
+        """
+        is_pos = False
+        for low in transaction_lows:
+            tx_type = _find_type(low)
+            if tx_type:
+                return True, tx_type
+            # "deposit" without "cash" still marks a POS transaction, but has no TYPE
+            if "deposit" in low:
+                is_pos = True
+        return is_pos, ""
     
-    def get_pos_transaction_type(transaction_lines):
-        """Get transaction type (SETTLEMENT, COMMISSION, CASH WITHDRAWAL, CASH DEPOSIT)"""
-        for line in transaction_lines:
-            low = line.lower()
-            if "settlement" in low:
-                return "SETTLEMENT"
-            elif "commission" in low:
-                return "COMMISSION"
-            elif "cash withdrawal" in low or "withdrawal" in low:
-                return "CASH WITHDRAWAL"
-            elif "cash deposit" in low or ("cash" in low and "deposit" in low):
-                return "CASH DEPOSIT"
-        return ""
-    
-    def parse_pos_transaction(transaction_lines, running_bal):
-        """Parse POS transaction"""
-        nonlocal running_balance
-        
+    def parse_pos_transaction(transaction_lines, running_bal, tx_type):
+        """Parse POS transaction; returns (trans, running balance after it)"""
         # Join all lines to get full transaction text
         full_text = " | ".join(transaction_lines)
         
         # Extract date from first line
         first_line = transaction_lines[0] if transaction_lines else ""
-        date_match = date_pattern.match(first_line[:10]) or re.match(r"(\d{1,2}-[A-Za-z]{3}-\d{2})", first_line)
+        date_match = _DATE_RE.match(first_line)
         if date_match:
-            try:
-                date = date_match.group(1)
-            except (IndexError, AttributeError):
-                # Fallback to group(0) if group(1) doesn't exist
-                date = date_match.group(0) if date_match else first_line[:10]
+            date = date_match.group(1)
         else:
             date = first_line[:10] if len(first_line) >= 10 else ""
         
-        # Get transaction type
-        tx_type = get_pos_transaction_type(transaction_lines)
-        
-        # Extract amounts
-        amounts = extract_amounts(full_text)
+        # Extract amounts line by line (an amount never spans the " | " separator):
+        # only the first two (amount, PDF balance) are used, so stop scanning there
+        line_amounts = (m.group(0) for line in transaction_lines for m in _AMOUNT_RE.finditer(line))
+        amounts = list(islice(line_amounts, 2))
         
         trans = {
             "SDate": date,
@@ -814,33 +833,22 @@ def convert_mixed_pdf_to_csv(pdf_path, original_filename=None):
         }
         
         if len(amounts) >= 2:
-            trans_amount = clean_amount(amounts[0])
-            pdf_balance = clean_amount(amounts[1])
+            trans_amount = _fast_amount(amounts[0])
+            pdf_balance = _fast_amount(amounts[1])
             
             # Store closing balance from PDF (source of truth)
             if pdf_balance:
                 trans["Closing Balance"] = f"{pdf_balance:,.2f}"
             
-            # Assign debit/credit based on type
-            if tx_type == "SETTLEMENT" or tx_type == "CASH DEPOSIT":
-                trans["Kredi"] = f"{trans_amount:,.2f}" if trans_amount else ""
-                trans["Debit"] = ""
-            elif tx_type == "COMMISSION" or tx_type == "CASH WITHDRAWAL":
-                trans["Debit"] = f"{trans_amount:,.2f}" if trans_amount else ""
-                trans["Kredi"] = ""
+            # Assign debit/credit based on type (left blank for an unknown TYPE)
+            is_credit = _TYPE_IS_CREDIT.get(tx_type)
+            if is_credit is not None:
+                trans["Kredi" if is_credit else "Debit"] = f"{trans_amount:,.2f}" if trans_amount else ""
             
             # Calculate balance using formula: Opening Balance - Debit + Credit
             # Note: Debit values are always positive (amounts are stored as positive)
             if running_bal is not None:
-                if tx_type == "COMMISSION" or tx_type == "CASH WITHDRAWAL":
-                    debit_val = abs(trans_amount)
-                    credit_val = 0.0
-                elif tx_type == "SETTLEMENT" or tx_type == "CASH DEPOSIT":
-                    debit_val = 0.0
-                    credit_val = abs(trans_amount)
-                else:
-                    debit_val = 0.0
-                    credit_val = 0.0
+                debit_val, credit_val = _debit_credit(tx_type, trans_amount)
                 calculated_balance = running_bal - debit_val + credit_val
                 trans["Balance"] = f"{calculated_balance:,.2f}"
                 
@@ -854,43 +862,37 @@ def convert_mixed_pdf_to_csv(pdf_path, original_filename=None):
                     trans["Difference"] = ""
                 
                 # Update running balance (use calculated for next transaction)
-                running_balance = calculated_balance
+                running_bal = calculated_balance
             elif pdf_balance:
                 # No running balance, use PDF balance
                 trans["Balance"] = f"{pdf_balance:,.2f}"
                 trans["Difference"] = "0.00"
         
-        return trans
+        return trans, running_bal
     
-    def parse_bank_transaction(transaction_lines, running_bal):
-        """Parse bank transaction using bank statement logic"""
-        nonlocal running_balance
-        
+    def parse_bank_transaction(transaction_lines, transaction_lows, running_bal):
+        """Parse bank transaction using bank statement logic; returns (trans, running balance after it)"""
         # First line has date and amounts
         first_line = transaction_lines[0] if transaction_lines else ""
-        date_match = date_pattern.match(first_line[:10]) or re.match(r"(\d{1,2}-[A-Za-z]{3}-\d{2})", first_line)
+        date_match = _DATE_RE.match(first_line)
         if date_match:
-            try:
-                date = date_match.group(1)
-            except (IndexError, AttributeError):
-                # Fallback to group(0) if group(1) doesn't exist
-                date = date_match.group(0) if date_match else first_line[:10]
+            date = date_match.group(1)
         else:
             date = first_line[:10] if len(first_line) >= 10 else ""
         
         # Extract amounts from first line
-        money = re.findall(amount_pattern, first_line)
-        desc = re.sub(amount_pattern, "", first_line[10:] if len(first_line) > 10 else first_line).strip()
+        money = _BANK_AMOUNT_RE.findall(first_line)
         
         debit = ""
         credit = ""
         balance = ""
+        debit_val = credit_val = 0.0
         
         if len(money) == 2:
             amount = money[0]
             balance = money[1]
-            amount_val = clean_amount(amount)
-            balance_val = clean_amount(balance)
+            amount_val = _fast_amount(amount)
+            balance_val = _fast_amount(balance)
             
             # Determine debit/credit from balance difference
             if running_bal is not None:
@@ -900,22 +902,27 @@ def convert_mixed_pdf_to_csv(pdf_path, original_filename=None):
                     if diff > 0:
                         # Balance increased = credit
                         credit = amount
+                        credit_val = amount_val
                         debit = ""
                     else:
                         # Balance decreased = debit (ensure positive value)
                         debit = amount.replace("-", "") if amount.startswith("-") else amount
+                        debit_val = abs(amount_val)
                         credit = ""
                 else:
                     # Use amount sign to determine debit/credit
                     if amount_val >= 0:
                         credit = amount
+                        credit_val = amount_val
                         debit = ""
                     else:
                         # Negative amount = debit, store as positive value
                         debit = amount.replace("-", "")
+                        debit_val = -amount_val
                         credit = ""
             else:
                 credit = amount
+                credit_val = amount_val
                 debit = ""
         
         # Join all lines for description
@@ -936,32 +943,27 @@ def convert_mixed_pdf_to_csv(pdf_path, original_filename=None):
         
         # Extract ByOrderOf and Beneficiary from ALL lines in transaction block using unified extraction
         # Check all lines to ensure we catch all variations
-        for line in transaction_lines:
-            line_clean = line.strip()
-            
+        for line, low in zip(transaction_lines, transaction_lows):
             # Extract ByOrderOf if not already found (check all lines)
             if not trans["ByOrderOf"]:
-                by_order = extract_by_order_of(line)
+                by_order = extract_by_order_of(line, low)
                 if by_order:
                     trans["ByOrderOf"] = by_order
             
             # Extract Beneficiary if not already found (check all lines)
             if not trans["Beneficiary"]:
-                beneficiary = extract_beneficiary(line)
+                beneficiary = extract_beneficiary(line, low)
                 if beneficiary:
                     trans["Beneficiary"] = beneficiary
         
         # Calculate balance using formula: Opening Balance - Debit + Credit
         if running_bal is not None:
-            debit_val = clean_amount(debit) if debit else 0.0
-            credit_val = clean_amount(credit) if credit else 0.0
             calculated_balance = running_bal - debit_val + credit_val
             trans["Balance"] = f"{calculated_balance:,.2f}"
             
             # Calculate difference: should be 0 if calculations are correct
             if balance:
-                closing_val = clean_amount(balance)
-                diff = calculated_balance - closing_val
+                diff = calculated_balance - balance_val
                 # Round to 2 decimal places to handle floating point precision
                 diff_rounded = round(diff, 2)
                 trans["Difference"] = f"{diff_rounded:,.2f}"
@@ -969,101 +971,134 @@ def convert_mixed_pdf_to_csv(pdf_path, original_filename=None):
                 trans["Difference"] = ""
             
             # Update running balance (use calculated for next transaction)
-            running_balance = calculated_balance
+            running_bal = calculated_balance
         elif balance:
             # No running balance, use PDF balance
-            closing_val = clean_amount(balance)
-            trans["Balance"] = f"{closing_val:,.2f}"
+            trans["Balance"] = f"{balance_val:,.2f}"
             trans["Difference"] = "0.00"
         
-        return trans
+        return trans, running_bal
     
     def flush_transaction():
         """Process and save collected transaction"""
-        nonlocal current_transaction_lines, running_balance
+        nonlocal current_transaction_lines, current_transaction_lows, running_balance
         if current_transaction_lines:
-            if is_pos_transaction(current_transaction_lines):
-                trans = parse_pos_transaction(current_transaction_lines, running_balance)
+            is_pos, tx_type = classify_transaction(current_transaction_lows)
+            if is_pos:
+                trans, running_balance = parse_pos_transaction(current_transaction_lines, running_balance, tx_type)
             else:
-                trans = parse_bank_transaction(current_transaction_lines, running_balance)
+                trans, running_balance = parse_bank_transaction(
+                    current_transaction_lines, current_transaction_lows, running_balance)
             rows.append(trans)
         current_transaction_lines = []
+        current_transaction_lows = []
     
     # Process lines
-    for i, line in enumerate(lines):
-        line = line.strip()
+    for line in lines:
         if not line:
             continue
         
         low = line.lower()
         
         # OPENING BALANCE
-        if low.startswith("opening balance") or "opening balance" in low:
-            money = re.findall(amount_pattern, line)
+        if "opening balance" in low:
+            money = _BANK_AMOUNT_RE.findall(line)
             if money:
-                opening_balance = clean_amount(money[-1])
+                opening_balance = _fast_amount(money[-1])
                 running_balance = opening_balance
             continue
         
         # New transaction detected (starts with date)
-        date_match = date_pattern.match(line[:10]) or re.match(r"(\d{1,2}-[A-Za-z]{3}-\d{2})", line)
+        date_match = _DATE_RE.match(line)
         if date_match:
             # Process previous transaction
             flush_transaction()
             
             # Start new transaction
             current_transaction_lines = [line]
+            current_transaction_lows = [low]
             continue
         
         # Continuation line - add to current transaction
         if current_transaction_lines:
             current_transaction_lines.append(line)
+            current_transaction_lows.append(low)
     
     # Process last transaction
     flush_transaction()
     
-    # Add opening balance row at the beginning
-    if opening_balance is not None:
-        rows.insert(0, {
-            "SDate": "",
-            "Pershkrimi": "Opening Balance",
-            "TYPE": "",
-            "ByOrderOf": "",
-            "Beneficiary": "",
-            "Debit": "",
-            "Kredi": "",
-            "Balance": f"{opening_balance:,.2f}",
-            "Closing Balance": f"{opening_balance:,.2f}",
-            "Difference": "0.00"
-        })
-    
-    # Save CSV with proper column order
-    df = pd.DataFrame(rows)
-    columns_order = ["SDate", "Pershkrimi", "TYPE", "ByOrderOf", "Beneficiary", "Debit", "Kredi", "Balance", "Closing Balance", "Difference"]
-    df = df[[col for col in columns_order if col in df.columns]]
+    # Opening balance row goes first: chained in front at write time instead of rows.insert(0, ...)
+    rows = chain(_opening_rows(opening_balance), rows)
     
-    # Generate filename: original_filename + date_processed
+    # Generate filename: original_filename + date_processed (ts is passed in by the upload route)
+    date_processed = ts or datetime.now().strftime("%Y%m%d_%H%M%S")
     if original_filename:
         base_name = os.path.splitext(os.path.basename(original_filename))[0]
         base_name_clean = clean_filename_value(base_name)
-        date_processed = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{base_name_clean}_{date_processed}.csv"
     else:
-        filename = "bkt_mixed_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv"
+        filename = "bkt_mixed_" + date_processed + ".csv"
     
-    out_file = os.path.join(RESULT_FOLDER, filename)
-    df.to_csv(out_file, index=False, quoting=csv.QUOTE_ALL)
-    return out_file
+    # Save CSV with proper column order
+    return _save_csv(rows, filename, output)
 
 
 # --------------------------------------------------------------------
 #  AUTO DETECT
 # --------------------------------------------------------------------
 
-def convert_pdf_to_csv(pdf_path, mode="auto", original_filename=None):
+def convert_pdf_to_csv(pdf_path, mode="auto", original_filename=None, output=None, ts=None):
     """Convert PDF to CSV - uses unified mixed parser for all modes to ensure consistent processing"""
     # Use unified mixed parser for all modes to ensure POS and other transactions are processed the same way
-    return convert_mixed_pdf_to_csv(pdf_path, original_filename)
+    return convert_mixed_pdf_to_csv(pdf_path, original_filename, output, ts)
+
+
+def _convert_to_bytes(pdf_path, mode, original_filename, ts):
+    """Worker: convert in memory and return (download name, CSV bytes) - a BytesIO can't cross processes"""
+    buf = io.BytesIO()
+    download_name = convert_pdf_to_csv(pdf_path, mode, original_filename, output=buf, ts=ts)
+    return download_name, buf.getvalue()
+
+
+def _get_convert_pool():
+    """Return the shared conversion pool, starting it on first use"""
+    global _convert_pool
+    with _convert_pool_lock:
+        if _convert_pool is None:
+            # Workers come from a forkserver, not a fork of this (threaded) server process,
+            # so they can't inherit locks held by other request threads. Windows has no
+            # forkserver: there (and on macOS) the default start method is spawn anyway.
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context("forkserver")
+            else:
+                mp_context = multiprocessing.get_context()
+            _convert_pool = ProcessPoolExecutor(max_workers=CONVERT_WORKERS, mp_context=mp_context)
+        return _convert_pool
+
+
+def _discard_convert_pool(pool):
+    """Drop a broken pool so the next request starts a fresh one (unless another thread already did)"""
+    global _convert_pool
+    with _convert_pool_lock:
+        if _convert_pool is pool:
+            _convert_pool = None
+    pool.shutdown(wait=False)
+
+
+def _convert_in_pool(fn, *args, **kwargs):
+    """
+    Run fn in the conversion pool and return its result. If the pool is broken (a
+    worker died), it is replaced and fn is retried once; a second failure raises
+    BrokenProcessPool - most likely the PDF itself crashes the worker.
+    """
+    for attempt in range(2):
+        pool = _get_convert_pool()
+        try:
+            return pool.submit(fn, *args, **kwargs).result()
+        except BrokenProcessPool:
+            _discard_convert_pool(pool)
+            if attempt:
+                raise
 
 
 # --------------------------------------------------------------------
@@ -1079,12 +1114,16 @@ def index():
 def upload():
     source = request.form.get("source", "local")
     mode = request.form.get("mode", "auto")
+    # One timestamp per request, shared by everything that names this upload's output
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
 
+    upload_path = None  # Work copy of a local upload, removed once converted
     if source == "server":
         filename = request.form.get("server_file")
         if not filename:
             return "No server file provided."
-        pdf_path = os.path.join(UPLOAD_FOLDER, filename)
+        # Only files directly inside UPLOAD_FOLDER can be picked (no "../" paths)
+        pdf_path = os.path.join(UPLOAD_FOLDER, os.path.basename(filename))
         if not os.path.exists(pdf_path):
             return f"File not found on server: {pdf_path}"
         original_filename = filename
@@ -1094,11 +1133,29 @@ def upload():
             return "No file uploaded."
 
         original_filename = file.filename
-        pdf_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        file.save(pdf_path)
-
-    output_csv = convert_pdf_to_csv(pdf_path, mode, original_filename)
-    return send_file(output_csv, as_attachment=True)
+        # The client's filename is never used as a path: it is sanitized, and each upload
+        # gets its own new file so uploads with the same name can't overwrite each other
+        stem = os.path.splitext(secure_filename(file.filename or ""))[0] or "upload"
+        with tempfile.NamedTemporaryFile(dir=UPLOAD_FOLDER, prefix=stem + "_", suffix=".pdf", delete=False) as tmp:
+            # 1 MiB chunks instead of Werkzeug's 16 KiB default; no fsync, the file is a work copy
+            shutil.copyfileobj(file.stream, tmp, 1 << 20)
+        pdf_path = upload_path = tmp.name
+
+    # Parsing is CPU-bound: run it in the process pool, this thread just waits for the result
+    try:
+        if SAVE_RESULTS:
+            output_csv = _convert_in_pool(convert_pdf_to_csv, pdf_path, mode, original_filename, ts=ts)
+            return send_file(output_csv, as_attachment=True)
+
+        # Stream the CSV from memory instead of writing it to RESULT_FOLDER and reading it back
+        download_name, data = _convert_in_pool(_convert_to_bytes, pdf_path, mode, original_filename, ts)
+    except BrokenProcessPool:
+        return "Conversion failed: the PDF could not be processed.", 500
+    finally:
+        # The conversion has finished (or failed) by now, so the work copy can go
+        if upload_path:
+            os.remove(upload_path)
+    return send_file(io.BytesIO(data), mimetype="text/csv", as_attachment=True, download_name=download_name)
 
 
 if __name__ == "__main__":
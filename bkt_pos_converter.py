@@ -1,65 +1,93 @@
+import csv
+import os
 import re
+from itertools import islice
 import fitz
-import pandas as pd
 
 pdf_path = "pos.pdf"
 
+# ---------------------------------------------------------
+# Patterns, compiled once instead of looked up on every line
+# ---------------------------------------------------------
+split_digits_pattern = re.compile(r"(\d)\s+(\d)")
+split_thousands_pattern = re.compile(r"(\d),\s+(\d)")
+split_decimals_pattern = re.compile(r"\s+(\.\d{2})")
+opening_balance_pattern = re.compile(r"OPENING BALANCE[: ]+([\d,]+\.\d{2})")
+date_pattern = re.compile(r"(\d{2}-[A-Z]{3}-\d{2})")
+amount_pattern = re.compile(r"([\d,]+\.\d{2})")
+
+# Plain-text extraction without ligature/whitespace preservation (the parser only needs
+# linear text); mediabox clipping stays on
+text_flags = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_LIGATURES & ~fitz.TEXT_PRESERVE_WHITESPACE
+
 doc = fitz.open(pdf_path)
 
 # ---------------------------------------------------------
 # Read raw text but preserve line order
 # ---------------------------------------------------------
-raw_lines = []
-for page in doc:
-    raw_lines.extend(page.get_text().split("\n"))
+def iter_raw_lines(doc):
+    # One page's text at a time, so the whole document is never held as lines
+    for page in doc:
+        yield from page.get_text("text", flags=text_flags).split("\n")
 
 # ---------------------------------------------------------
 # Normalize: combine broken lines and remove number spaces
 # ---------------------------------------------------------
 
-cleaned_lines = []
-buffer = ""
+def iter_cleaned_lines(raw_lines):
+    # Yields (line, line.upper()): each line is upper-cased once for every
+    # case-insensitive check here and in the parse loop
+    buffer = ""
+    buffer_upper = ""
 
-for line in raw_lines:
-    # Remove spacing inside numbers e.g. "37 567 . 82" → "37567.82"
-    fixed = re.sub(r"(\d)\s+(\d)", r"\1\2", line)          # join digits split by space
-    fixed = re.sub(r"(\d),\s+(\d)", r"\1,\2", fixed)        # join 37, 567
-    fixed = re.sub(r"\s+(\.\d{2})", r"\1", fixed)           # join ". 82"
+    for line in raw_lines:
+        # Remove spacing inside numbers e.g. "37 567 . 82" → "37567.82"
+        # The passes run in this order (each sees the previous one's output); the last
+        # two are skipped on lines without the comma / dot they need
+        fixed = split_digits_pattern.sub(r"\1\2", line)           # join digits split by space
+        if "," in fixed:
+            fixed = split_thousands_pattern.sub(r"\1,\2", fixed)  # join 37, 567
+        if "." in fixed:
+            fixed = split_decimals_pattern.sub(r"\1", fixed)      # join ". 82"
 
-    # Join lines that belong together
-    if "OPENING BALANCE" in fixed.upper():
-        buffer = fixed
-        continue
-    if buffer:
-        fixed = buffer + " " + fixed
-        buffer = ""
+        fixed_upper = fixed.upper()
+
+        # Join lines that belong together
+        if "OPENING BALANCE" in fixed_upper:
+            buffer = fixed
+            buffer_upper = fixed_upper
+            continue
+        if buffer:
+            fixed = buffer + " " + fixed
+            fixed_upper = buffer_upper + " " + fixed_upper
+            buffer = ""
 
-    cleaned_lines.append(fixed)
+        yield fixed, fixed_upper
 
-lines = cleaned_lines
+# Lines are read, normalized and parsed one at a time
+lines = iter_cleaned_lines(iter_raw_lines(doc))
 
 
 # ---------------------------------------------------------
 # Parse lines
 # ---------------------------------------------------------
 
-results = []
+# One list per column, zipped into rows when the CSV is written
+dates, descriptions, debits, credits, balances = [], [], [], [], []
 opening_balance = None
 transactions_started = False
 
-date_pattern = r"(\d{2}-[A-Z]{3}-\d{2})"
-
-for raw in lines:
+for raw, raw_upper in lines:
 
     # 1) Detect OPENING BALANCE with flexible regex
-    if "OPENING BALANCE" in raw.upper():
-        match = re.search(r"OPENING BALANCE[: ]+([\d,]+\.\d{2})", raw)
+    if "OPENING BALANCE" in raw_upper:
+        match = opening_balance_pattern.search(raw)
         if match:
             opening_balance = float(match.group(1).replace(",", ""))
         continue
 
     # 2) After BOOKING DATE → transactions start
-    if "BOOKING DATE" in raw.upper():
+    if "BOOKING DATE" in raw_upper:
         transactions_started = True
         continue
 
@@ -67,14 +95,16 @@ for raw in lines:
         continue
 
     # 3) Detect transaction row
-    date_match = re.search(date_pattern, raw)
+    date_match = date_pattern.search(raw)
     if not date_match:
         continue
 
     date = date_match.group(1)
 
-    # 4) Extract all numeric fields
-    amounts = re.findall(r"([\d,]+\.\d{2})", raw)
+    # 4) Extract the numeric fields: only the first two (amount, balance) are used,
+    #    so the scan stops there; the match positions are kept for the sign check
+    amount_matches = list(islice(amount_pattern.finditer(raw), 2))
+    amounts = [m.group(1) for m in amount_matches]
 
     debit = ""
     credit = ""
@@ -83,9 +113,8 @@ for raw in lines:
     if len(amounts) >= 1:
         amount = float(amounts[0].replace(",", ""))
 
-        # detect sign by looking before number
-        before_amount = raw.split(amounts[0])[0]
-        if "-" in before_amount:
+        # detect sign by looking before number (searched in place, no split copies)
+        if raw.rfind("-", 0, amount_matches[0].start()) != -1:
             debit = amount
         else:
             credit = amount
@@ -101,18 +130,16 @@ for raw in lines:
             opening_balance += credit
         balance = opening_balance
 
-    results.append({
-        "Date": date,
-        "Description": raw.strip(),
-        "Type": "",
-        "Other": "",
-        "Debit": debit,
-        "Credit": credit,
-        "Balance": balance
-    })
-
-# Save to CSV
-df = pd.DataFrame(results)
-df.to_csv("pos_output.csv", index=False)
+    dates.append(date)
+    descriptions.append(raw.strip())
+    debits.append(debit)
+    credits.append(credit)
+    balances.append(balance)
+
+# Save to CSV (same layout DataFrame.to_csv wrote: minimal quoting, None as empty)
+with open("pos_output.csv", "w", newline="", encoding="utf-8") as f:
+    writer = csv.writer(f, lineterminator=os.linesep)
+    writer.writerow(["Date", "Description", "Type", "Other", "Debit", "Credit", "Balance"])
+    writer.writerows(zip(dates, descriptions, [""] * len(dates), [""] * len(dates), debits, credits, balances))
 
 print("POS conversion completed → pos_output.csv")